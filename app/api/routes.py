@@ -1,7 +1,10 @@
 """API route handlers"""
-from fastapi import APIRouter, status, BackgroundTasks, Body, Depends
+from fastapi import APIRouter, status, BackgroundTasks, Body, Depends, Header, HTTPException
 from datetime import datetime
 from sqlalchemy.orm import Session
+import asyncio
+import hashlib
+import json
 import uuid
 import httpx
 import random
@@ -13,7 +16,10 @@ from app.schemas.models import (
     ExperimentPayload,
     ExperimentSummary,
     AffirmationHistoryItem,
-    ChampionPhraseResponse
+    ChampionPhraseResponse,
+    InstrumentationSettings,
+    InstrumentationUpdate,
+    ArchiveRunSummary
 )
 from app.services.ferret_service import (
     process_affirmation_and_callback,
@@ -21,10 +27,15 @@ from app.services.ferret_service import (
     update_affirmation_result,
     create_experiment
 )
+from app.services.idempotency_service import ClaimedKey, lookup_key, reserve_key, release_key
+from app.services.archive_service import archive_completed_results, query_affirmation_history
 from app.db.session import get_db
-from app.db.models import AffirmationResult, ChampionPhrase, Experiment
+from app.db.models import ChampionPhrase, Experiment
+from app.instrumentation.loop_monitor import configure_loop_monitor
+from app.instrumentation.settings import settings as instrumentation_settings
+from app.instrumentation.timing import TimedRoute, timed
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)  # TimedRoute reports response serialization in Server-Timing
 
 
 @router.get("/", response_model=Message)
@@ -39,15 +50,42 @@ async def health_check() -> dict[str, str]:
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+@router.get("/instrumentation", response_model=InstrumentationSettings)
+async def get_instrumentation() -> InstrumentationSettings:
+    """Get the current performance instrumentation settings"""
+    return instrumentation_settings
+
+
+@router.put("/instrumentation", response_model=InstrumentationSettings)
+async def update_instrumentation(update: InstrumentationUpdate) -> InstrumentationSettings:
+    """Switch profiling, loop lag monitoring and Server-Timing on or off at runtime"""
+    for field, value in update.model_dump(exclude_none=True).items():
+        setattr(instrumentation_settings, field, value)
+
+    # Start, stop or restart the loop monitor to match the new settings
+    configure_loop_monitor(instrumentation_settings.loop_monitor_enabled, instrumentation_settings.loop_lag_threshold_ms)
+
+    print(f"[INSTRUMENTATION] 🔧 Settings updated: {instrumentation_settings.model_dump()}")
+    return instrumentation_settings
+
+
 @router.post("/webhook/ferret-reaction")
 async def webhook_ferret_reaction(callback: WebhookCallback) -> dict[str, str]:
     """Webhook endpoint to receive ferret joy reactions"""
     print(f"[WEBHOOK] 📬 Received ferret reaction for affirmation {callback.affirmation_id}")
     print(f"[WEBHOOK] 🦦 Ferret Response: {'✨ JOY SPARKED!' if callback.joy_sparked else '😑 Unimpressed.'}")
     print(f"[WEBHOOK] ⏰ Timestamp: {callback.timestamp}")
-    
-    # Update database with ferret reaction
-    update_affirmation_result(callback.affirmation_id, callback.joy_sparked)
+
+    # Update database with ferret reaction (redelivered callbacks are ignored so the stored reaction isn't rewritten)
+    result = await asyncio.to_thread(update_affirmation_result, callback.affirmation_id, callback.joy_sparked)
+    if result == "duplicate":
+        print(f"[WEBHOOK] 🔁 Duplicate callback ignored for affirmation {callback.affirmation_id}")
+        return {"status": "duplicate", "affirmation_id": callback.affirmation_id}
+    if result == "not_found":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Affirmation {callback.affirmation_id} not found")
+    if result == "error":
+        # nothing was recorded, so the sender can safely redeliver
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not record ferret reaction, please retry")
     
     return {"status": "received", "affirmation_id": callback.affirmation_id}
 
@@ -74,8 +112,9 @@ async def run_experiment(payload: ExperimentPayload, db: Session = Depends(get_d
                 # for each item in array, randomly call affirmation endpoint with either new phrase or None if current run will test champion
                 for current_run in range(1, payload.runs + 1):
                     test_phrase = payload.new_affirmation if random.choice([True, False]) else None
-                    async with httpx.AsyncClient() as client: 
-                        await client.post("http://localhost:8000/affirmation", json={"experiment_id": experiment_id, "suggested_affirmation": test_phrase, "current_run": current_run, "target_runs": payload.runs})
+                    with timed("http"):
+                        async with httpx.AsyncClient() as client:
+                            await client.post("http://localhost:8000/affirmation", json={"experiment_id": experiment_id, "suggested_affirmation": test_phrase, "current_run": current_run, "target_runs": payload.runs}, headers={"Idempotency-Key": f"experiment-{experiment_id}-run-{current_run}"})
 
                 print(f"[EXPERIMENT] 🧪 Experiment {experiment_id} initiated with {payload.runs} runs testing new affirmation: '{payload.new_affirmation}' against champion: '{champion_phrase}'")
                 return {"number of runs": payload.runs, "new phrase to test: ": payload.new_affirmation, "experiment id": experiment_id or "invalid input"}
@@ -125,6 +164,19 @@ async def get_experiment_history(
     ]
 
 
+def _replay_affirmation(original: ClaimedKey, fingerprint: str) -> AffirmationResponse:
+    """Answer a retried POST /affirmation from the request that first used its Idempotency-Key"""
+    if original.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=422,  # Unprocessable Content (constant name differs across Starlette versions)
+            detail="Idempotency-Key was already used with a different request body"
+        )
+    return AffirmationResponse(
+        affirmation_id=original.value,
+        message="Your words were already shared with the ferrets! They're still contemplating... 🦦"
+    )
+
+
 # if a suggested affirmation is provided, use that, else get current champion from db as originally implemented
 @router.post("/affirmation", response_model=AffirmationResponse, status_code=status.HTTP_202_ACCEPTED)
 async def share_affirmation(
@@ -133,40 +185,67 @@ async def share_affirmation(
     experiment_id: int | None = Body(default=None, embed=True), # experiment id if this call is part of an experiment
     suggested_affirmation: str | None = Body(default=None, embed=True), # new affirmation to test, will use current champion if this value is not provided
     current_run: int | None = Body(default=None, embed=True), # tells which run we are currently analyzing
-    target_runs: int | None = Body(default=None, embed=True) # total number of runs for experiment
+    target_runs: int | None = Body(default=None, embed=True), # total number of runs for experiment
+    idempotency_key: str | None = Header(default=None) # retries with the same key get the original affirmation back
 ) -> AffirmationResponse:
     """Share the champion affirmation with our fickle ferrets - returns immediately and processes asynchronously"""
-    
-    # Use suggested affirmation if provided, else get current champion from DB
-    if(suggested_affirmation):
-        words_of_affirmation = suggested_affirmation
-        testing_champion = False
-    else:
-        # Get current champion phrase from database
-        champion = db.query(ChampionPhrase).filter(ChampionPhrase.id == 1).first()
-        words_of_affirmation = champion.phrase
-        testing_champion = True
-    
+
     # Generate unique affirmation ID
     affirmation_id = str(uuid.uuid4())
-    
-    # Create database record for this affirmation
-    create_affirmation_record(affirmation_id, words_of_affirmation)
-    
-    # Construct webhook URL (assuming localhost for development)
-    webhook_url = "http://localhost:8000/webhook/ferret-reaction"
-    
-    # Add background task to share affirmation with ferrets and get their reaction
-    background_tasks.add_task(
-        process_affirmation_and_callback,
-        affirmation_id,
-        words_of_affirmation,
-        webhook_url,
-        experiment_id,
-        testing_champion,
-        current_run,
-        target_runs
-    )
+
+    # Answer retries from the original request instead of creating a new affirmation and calling Spark again
+    fingerprint = None
+    if idempotency_key:
+        fingerprint = hashlib.sha256(json.dumps(
+            [experiment_id, suggested_affirmation, current_run, target_runs]
+        ).encode()).hexdigest()
+        original = await asyncio.to_thread(lookup_key, "affirmation", idempotency_key)
+        if original is not None:
+            return _replay_affirmation(original, fingerprint)
+        if not reserve_key("affirmation", idempotency_key):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed"
+            )
+
+    # the key is only recorded together with the affirmation record, so if anything below fails a retry runs fresh
+    try:
+        # Use suggested affirmation if provided, else get current champion from DB
+        if(suggested_affirmation):
+            words_of_affirmation = suggested_affirmation
+            testing_champion = False
+        else:
+            # Get current champion phrase from database
+            champion = db.query(ChampionPhrase).filter(ChampionPhrase.id == 1).first()
+            words_of_affirmation = champion.phrase
+            testing_champion = True
+        
+        # Create database record for this affirmation
+        created = await asyncio.to_thread(create_affirmation_record, affirmation_id, words_of_affirmation, idempotency_key, fingerprint)
+        if created == "duplicate":
+            # the original request committed between our lookup and reservation; answer from it
+            original = await asyncio.to_thread(lookup_key, "affirmation", idempotency_key)
+            return _replay_affirmation(original, fingerprint)
+        if created == "error":
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Could not record affirmation, please retry")
+        
+        # Construct webhook URL (assuming localhost for development)
+        webhook_url = "http://localhost:8000/webhook/ferret-reaction"
+        
+        # Add background task to share affirmation with ferrets and get their reaction
+        background_tasks.add_task(
+            process_affirmation_and_callback,
+            affirmation_id,
+            words_of_affirmation,
+            webhook_url,
+            experiment_id,
+            testing_champion,
+            current_run,
+            target_runs
+        )
+    finally:
+        if idempotency_key:
+            release_key("affirmation", idempotency_key)
     
     print(f"[AFFIRMATION] 🦦 New affirmation received! ID: {affirmation_id}")
     print(f"[AFFIRMATION] 📝 Using champion phrase: '{words_of_affirmation}'")
@@ -191,23 +270,20 @@ async def get_champion_phrase(db: Session = Depends(get_db)) -> ChampionPhraseRe
 @router.get("/affirmations/history", response_model=list[AffirmationHistoryItem])
 async def get_affirmation_history(
     limit: int = 50,
-    db: Session = Depends(get_db)
+    before: datetime | None = None, # cursor: only affirmations created before this (pass the last created_at to page)
+    since: datetime | None = None # only affirmations created at or after this
 ) -> list[AffirmationHistoryItem]:
-    """Get history of affirmations and ferret reactions"""
-    # Query database for recent affirmations
-    results = db.query(AffirmationResult).order_by(
-        AffirmationResult.created_at.desc()
-    ).limit(limit).all()
+    """Get history of affirmations and ferret reactions (older results are read from the archive)"""
+    # Query hot database, falling back to archive partitions when the range reaches past it
+    results = await asyncio.to_thread(query_affirmation_history, limit, before, since)
     
     # Convert to response models
-    return [
-        AffirmationHistoryItem(
-            affirmation_id=result.affirmation_id,
-            words_of_affirmation=result.words_of_affirmation,
-            joy_sparked=result.joy_sparked,
-            created_at=result.created_at,
-            callback_received_at=result.callback_received_at
-        )
-        for result in results
-    ]
+    return [AffirmationHistoryItem(**result) for result in results]
+
+
+@router.post("/archive/run", response_model=ArchiveRunSummary)
+async def run_archive() -> ArchiveRunSummary:
+    """Run the retention job now: archive completed results older than the retention window"""
+    summary = await asyncio.to_thread(archive_completed_results)
+    return ArchiveRunSummary(**summary)
 
@@ -1,5 +1,5 @@
 """SQLAlchemy database models"""
-from sqlalchemy import Column, String, Boolean, DateTime, Integer, Numeric
+from sqlalchemy import Column, String, Boolean, Date, DateTime, Integer, Numeric
 from datetime import datetime
 from .base import Base
 
@@ -23,7 +23,7 @@ class AffirmationResult(Base):
     affirmation_id = Column(String, primary_key=True, index=True)
     words_of_affirmation = Column(String, nullable=False)
     joy_sparked = Column(Boolean, nullable=False)
-    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)  # history cursors + retention scans
     callback_received_at = Column(DateTime, nullable=True)
     
     def __repr__(self) -> str:
@@ -49,4 +49,34 @@ class Experiment(Base):
     created_at = Column(DateTime, default=datetime.now, nullable=False)
 
     def __repr__(self) -> str:
-        return f"<Experiment(id={self.id}, a_approval={self.variant_a_approval_rate}, b_approval={self.variant_b_approval_rate}, status={self.status})>"
\ No newline at end of file
+        return f"<Experiment(id={self.id}, a_approval={self.variant_a_approval_rate}, b_approval={self.variant_b_approval_rate}, status={self.status})>"
+
+
+class IdempotencyKey(Base):
+    """Store processed idempotency keys so duplicate requests can be answered without reprocessing"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)  # "<scope>:<key>", e.g. "affirmation:<Idempotency-Key header>"
+    value = Column(String, nullable=False)  # result to replay for duplicates (e.g. the affirmation id)
+    fingerprint = Column(String, nullable=True)  # hash of the original request body, to reject key reuse with a different body
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<IdempotencyKey(key={self.key}, value={self.value})>"
+
+
+class ArchivePartition(Base):
+    """Manifest of archived affirmation_results part files (each archive batch writes one immutable part)"""
+    __tablename__ = "archive_manifest"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(Date, nullable=False, index=True)  # created_at date of the archived rows
+    part = Column(Integer, nullable=False)  # part number within the day
+    path = Column(String, nullable=False, unique=True)  # archive file holding the part's rows
+    row_count = Column(Integer, nullable=False)
+    min_created_at = Column(DateTime, nullable=False)
+    max_created_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<ArchivePartition(day={self.day}, part={self.part}, rows={self.row_count})>"
@@ -0,0 +1 @@
+"""Opt-in performance instrumentation (profiling, loop lag, Server-Timing)"""
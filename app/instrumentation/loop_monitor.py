@@ -0,0 +1,90 @@
+"""Event-loop stall detector that logs where the loop is blocked"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+
+class LoopLagMonitor:
+    """Detect event-loop stalls longer than a threshold and log the blocking stack
+
+    A heartbeat task on the loop records when it last ran; a watchdog thread notices when the
+    heartbeat goes stale and captures the loop thread's stack *while* it is still blocked, which
+    is what points at the offending synchronous call.
+    """
+
+    def __init__(self, threshold_ms: float, interval_s: float = 0.05) -> None:
+        self.threshold_s = threshold_ms / 1000
+        self.interval_s = interval_s
+        self._last_beat = 0.0
+        self._reported_beat = 0.0
+        self._loop_thread_id: int | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat is not None and not self._heartbeat.done()
+
+    def start(self) -> None:
+        """Start monitoring the running event loop (must be called from the loop thread)"""
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        print(f"[LOOP] 🩺 Event-loop lag monitor started (threshold {self.threshold_s * 1000:.0f}ms)")
+
+    def stop(self) -> None:
+        """Stop the heartbeat task and watchdog thread"""
+        if self._heartbeat is None:
+            return
+        self._stopped.set()
+        self._heartbeat.cancel()
+        self._heartbeat = None
+        self._watchdog = None
+        print("[LOOP] 🩺 Event-loop lag monitor stopped")
+
+    async def _beat(self) -> None:
+        """Record a heartbeat every interval and report how late each wake-up was"""
+        while True:
+            before = time.monotonic()
+            self._last_beat = before
+            await asyncio.sleep(self.interval_s)
+            lag = time.monotonic() - before - self.interval_s
+            if lag > self.threshold_s:
+                print(f"[LOOP] 🐢 Event loop was blocked for {lag * 1000:.0f}ms")
+
+    def _watch(self) -> None:
+        """Watchdog thread: dump the loop thread's stack once per stall"""
+        while not self._stopped.wait(self.interval_s):
+            beat = self._last_beat
+            stalled_for = time.monotonic() - beat - self.interval_s
+            if stalled_for <= self.threshold_s or beat == self._reported_beat:
+                continue
+            self._reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            print(f"[LOOP] 🐢 Event loop blocked for over {stalled_for * 1000:.0f}ms, currently at:\n{stack}")
+
+
+# Shared monitor instance, (re)created when the threshold changes at runtime
+monitor: LoopLagMonitor | None = None
+
+
+def configure_loop_monitor(enabled: bool, threshold_ms: float) -> None:
+    """Start, stop or restart the shared monitor to match the given settings"""
+    global monitor
+    if monitor is not None and (not enabled or monitor.threshold_s != threshold_ms / 1000):
+        monitor.stop()
+        monitor = None
+    if enabled and monitor is None:
+        monitor = LoopLagMonitor(threshold_ms)
+        monitor.start()
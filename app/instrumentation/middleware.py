@@ -0,0 +1,49 @@
+"""ASGI middleware wiring request profiling and Server-Timing into the app"""
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .profiler import profile_call, should_profile
+from .settings import settings
+from .timing import start_request_timer, stop_request_timer
+
+
+class InstrumentationMiddleware:
+    """Profile sampled requests and attach a Server-Timing header when enabled
+
+    Settings are checked per request, so toggling them at runtime takes effect immediately;
+    with everything off a request goes straight through to the app.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profiling = should_profile()
+        if not (profiling or settings.server_timing_enabled):
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        if settings.server_timing_enabled:
+            timer, token = start_request_timer()
+
+            async def send_with_timing(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", timer.header_value())
+                await send(message)
+        else:
+            send_with_timing = send
+
+        try:
+            if profiling:
+                await profile_call(scope["method"], scope["path"], lambda: self.app(scope, receive, send_with_timing))
+            else:
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            if token is not None:
+                stop_request_timer(token)
@@ -0,0 +1,64 @@
+"""Sampling request profiler that writes cProfile dumps to disk"""
+import asyncio
+import cProfile
+import os
+import random
+import re
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from .settings import settings
+
+# cProfile can only have one active profiler per interpreter, so at most one request is profiled at a time
+_profiling_active = False
+
+
+def should_profile() -> bool:
+    """Decide whether the current request is sampled for profiling (claims the profiler if so)"""
+    global _profiling_active
+    rate = settings.profile_sample_rate
+    if rate <= 0.0 or _profiling_active or random.random() >= rate:
+        return False
+    _profiling_active = True
+    return True
+
+
+def _profile_path(method: str, path: str) -> str:
+    """Build a unique, filesystem-safe file name for a request profile"""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    return os.path.join(settings.profile_dir, f"{stamp}-{method}-{slug}-{uuid.uuid4().hex[:8]}.prof")
+
+
+def _dump_profile(profiler: cProfile.Profile, file_path: str) -> None:
+    """Write profile stats to disk (loadable with pstats or snakeviz)"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    profiler.dump_stats(file_path)
+
+
+async def profile_call(method: str, path: str, call: Callable[[], Awaitable[None]]) -> None:
+    """Await the call under cProfile and write the result to the profile directory
+
+    Must only be called after should_profile() returned True, which claims the profiler.
+
+    cProfile hooks the whole loop thread, so other coroutines interleaved with this request
+    show up in its profile too; keep the sample rate low to keep profiles readable. Work offloaded
+    with asyncio.to_thread (the SQLite calls) is invisible here; the "db" Server-Timing metric covers it.
+    """
+    global _profiling_active
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            await call()
+        finally:
+            profiler.disable()
+    finally:
+        _profiling_active = False
+    file_path = _profile_path(method, path)
+    try:
+        await asyncio.to_thread(_dump_profile, profiler, file_path)
+        print(f"[PROFILER] 🔬 Wrote profile for {method} {path} to {file_path}")
+    except OSError as e:
+        print(f"[PROFILER] ❌ Error writing profile for {method} {path}: {e}")
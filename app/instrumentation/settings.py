@@ -0,0 +1,23 @@
+"""Runtime-switchable instrumentation settings"""
+import os
+
+from app.schemas.models import InstrumentationSettings
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    """Read a boolean flag from the environment"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Process-wide settings, seeded from the environment and mutable at runtime via PUT /instrumentation.
+# Everything defaults to off so an uninstrumented server pays nothing.
+settings = InstrumentationSettings(
+    profile_sample_rate=float(os.getenv("FERRETS_PROFILE_SAMPLE_RATE", "0.0")),
+    profile_dir=os.getenv("FERRETS_PROFILE_DIR", "./profiles"),
+    loop_monitor_enabled=_env_flag("FERRETS_LOOP_MONITOR"),
+    loop_lag_threshold_ms=float(os.getenv("FERRETS_LOOP_LAG_THRESHOLD_MS", "100")),
+    server_timing_enabled=_env_flag("FERRETS_SERVER_TIMING"),
+)
@@ -0,0 +1,144 @@
+"""Per-request timing breakdowns reported via the Server-Timing header"""
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Iterator
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+# Timer for the request being handled; None whenever Server-Timing is off so recording is a no-op
+_current_timer: ContextVar["RequestTimer | None"] = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Accumulate elapsed time per category (db, http, serialize) for one request"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.totals: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.commit_started: float | None = None
+        self.endpoint_returned: float | None = None
+
+    def add(self, category: str, elapsed: float) -> None:
+        """Add elapsed seconds to a category"""
+        self.totals[category] = self.totals.get(category, 0.0) + elapsed
+        self.counts[category] = self.counts.get(category, 0) + 1
+
+    def header_value(self) -> str:
+        """Render the Server-Timing header value (durations in milliseconds)"""
+        metrics = [
+            f'{category};dur={seconds * 1000:.2f};desc="{self.counts[category]} call(s)"'
+            for category, seconds in self.totals.items()
+        ]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+def start_request_timer() -> tuple[RequestTimer, Any]:
+    """Install a fresh timer for the current request, returning it with its reset token"""
+    timer = RequestTimer()
+    return timer, _current_timer.set(timer)
+
+
+def stop_request_timer(token: Any) -> None:
+    """Remove the current request's timer"""
+    _current_timer.reset(token)
+
+
+@contextmanager
+def timed(category: str) -> Iterator[None]:
+    """Attribute the wrapped block's wall time to a Server-Timing category"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(category, time.perf_counter() - started)
+
+
+def _mark_endpoint_return(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a route endpoint so the request timer knows when it returned (serialization starts there)"""
+
+    def mark() -> None:
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.endpoint_returned = time.perf_counter()
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_endpoint(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                mark()
+        return async_endpoint
+
+    @functools.wraps(endpoint)
+    def sync_endpoint(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            mark()
+    return sync_endpoint
+
+
+class TimedRoute(APIRoute):
+    """Route recording FastAPI's response serialization (response_model validation,
+    jsonable_encoder and rendering) as "serialize" time"""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, _mark_endpoint_return(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            response = await handler(request)
+            timer = _current_timer.get()
+            if timer is not None and timer.endpoint_returned is not None:
+                timer.add("serialize", time.perf_counter() - timer.endpoint_returned)
+                timer.endpoint_returned = None
+            return response
+
+        return timed_handler
+
+
+def instrument_db(engine: Engine, session_factory: sessionmaker) -> None:
+    """Record time spent executing SQL statements and committing as "db" time"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        if _current_timer.get() is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        timer = _current_timer.get()
+        started = conn.info.get("query_started")
+        if timer is not None and started:
+            timer.add("db", time.perf_counter() - started.pop())
+
+    # Commits bypass cursor execution but are where SQLite actually fsyncs, so time them separately:
+    # the engine "commit" event fires right before the DBAPI commit, the session's "after_commit" right after.
+    @event.listens_for(engine, "commit")
+    def _before_dbapi_commit(conn) -> None:
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.commit_started = time.perf_counter()
+
+    @event.listens_for(session_factory, "after_commit")
+    def _after_session_commit(session) -> None:
+        timer = _current_timer.get()
+        if timer is not None and timer.commit_started is not None:
+            timer.add("db", time.perf_counter() - timer.commit_started)
+            timer.commit_started = None
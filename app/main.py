@@ -1,9 +1,15 @@
 from fastapi import FastAPI
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+import asyncio
 from .api.routes import router
 from .db.base import Base
 from .db.session import engine, SessionLocal
 from .db.models import ChampionPhrase
+from .instrumentation.loop_monitor import configure_loop_monitor
+from .instrumentation.middleware import InstrumentationMiddleware
+from .instrumentation.settings import settings as instrumentation_settings
+from .instrumentation.timing import instrument_db
+from .services.archive_service import RETENTION_INTERVAL_SECONDS, enable_incremental_vacuum, ensure_indexes, run_retention_periodically
 
 
 @asynccontextmanager
@@ -12,6 +18,8 @@ async def lifespan(app: FastAPI):
     # Create all tables
     print("[DATABASE] 🗄️  Initializing SQLite database...")
     Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+    enable_incremental_vacuum()
     print("[DATABASE] ✅ Database initialized successfully!")
     
     # Seed champion phrase if not exists
@@ -31,8 +39,19 @@ async def lifespan(app: FastAPI):
     finally:
         db.close()
     
+    # Start the event-loop stall detector if enabled via environment
+    configure_loop_monitor(instrumentation_settings.loop_monitor_enabled, instrumentation_settings.loop_lag_threshold_ms)
+
+    # Periodically move old completed results to the archive
+    retention_task = asyncio.create_task(run_retention_periodically()) if RETENTION_INTERVAL_SECONDS > 0 else None
+
     yield
-    # Cleanup (if needed)
+    # Cleanup
+    configure_loop_monitor(False, instrumentation_settings.loop_lag_threshold_ms)
+    if retention_task is not None:
+        retention_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await retention_task
 
 
 app = FastAPI(
@@ -42,6 +61,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Opt-in performance instrumentation (see PUT /instrumentation)
+instrument_db(engine, SessionLocal)
+app.add_middleware(InstrumentationMiddleware)
+
 # Include API routes
 app.include_router(router)
 
@@ -74,3 +74,28 @@ class AffirmationHistoryItem(BaseModel):
     class Config:
         from_attributes = True  # Enables compatibility with SQLAlchemy models
 
+
+
+class InstrumentationSettings(BaseModel):
+    """Current performance instrumentation settings"""
+    profile_sample_rate: float = Field(0.0, ge=0.0, le=1.0, description="Fraction of requests to profile (0 disables profiling)")
+    profile_dir: str = Field("./profiles", description="Directory where request profiles are written (FERRETS_PROFILE_DIR only, not changeable at runtime)")
+    loop_monitor_enabled: bool = Field(False, description="Whether the event-loop stall detector is running")
+    loop_lag_threshold_ms: float = Field(100.0, gt=0.0, description="Loop stall (ms) that triggers a stack trace log")
+    server_timing_enabled: bool = Field(False, description="Whether responses carry a Server-Timing header")
+
+
+class InstrumentationUpdate(BaseModel):
+    """Partial update of instrumentation settings (omitted fields are left unchanged)"""
+    profile_sample_rate: float | None = Field(None, ge=0.0, le=1.0, description="Fraction of requests to profile")
+    loop_monitor_enabled: bool | None = Field(None, description="Start or stop the event-loop stall detector")
+    loop_lag_threshold_ms: float | None = Field(None, gt=0.0, description="Loop stall (ms) that triggers a stack trace log")
+    server_timing_enabled: bool | None = Field(None, description="Enable or disable the Server-Timing header")
+
+
+class ArchiveRunSummary(BaseModel):
+    """Result of a retention/archive run"""
+    status: str = Field(..., description="completed, already_running or failed")
+    archived_rows: int = Field(..., description="Affirmation results moved to the archive")
+    partitions: int = Field(..., description="Day partitions written")
+    expired_keys: int = Field(..., description="Idempotency keys purged past their 24h TTL")
@@ -0,0 +1,275 @@
+"""Service for tiering old affirmation results into a compressed on-disk archive"""
+import asyncio
+import gzip
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import groupby
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from ..db.models import AffirmationResult, ArchivePartition
+from ..db.session import SessionLocal, engine
+from .idempotency_service import purge_expired_keys
+
+# Retention settings (completed results older than RETENTION_DAYS move to the archive)
+ARCHIVE_DIR: str = os.getenv("FERRETS_ARCHIVE_DIR", "./archive")
+RETENTION_DAYS: int = int(os.getenv("FERRETS_RETENTION_DAYS", "30"))
+RETENTION_INTERVAL_SECONDS: float = float(os.getenv("FERRETS_RETENTION_INTERVAL_SECONDS", "3600"))  # 0 disables the periodic job
+VACUUM_PAGES_PER_RUN: int = int(os.getenv("FERRETS_VACUUM_PAGES_PER_RUN", "2000"))
+ARCHIVE_BATCH_SIZE: int = int(os.getenv("FERRETS_ARCHIVE_BATCH_SIZE", "5000"))  # max rows moved per transaction
+
+# Serializes archive runs (periodic job vs POST /archive/run)
+_archive_lock = threading.Lock()
+
+# Archived columns, in file order
+_COLUMNS = ("affirmation_id", "words_of_affirmation", "joy_sparked", "created_at", "callback_received_at")
+
+
+def enable_incremental_vacuum() -> None:
+    """Switch the SQLite file to incremental auto-vacuum so archived space can be reclaimed in small steps"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            # Changing auto_vacuum on an existing database only takes effect after a full VACUUM (one-off)
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+            print("[ARCHIVE] 🧹 Enabled incremental auto-vacuum on the database")
+
+
+def ensure_indexes() -> None:
+    """Create indexes that create_all() won't add to tables from an existing database"""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_affirmation_results_created_at ON affirmation_results (created_at)"))
+
+
+def _part_path(day: date, part: int) -> str:
+    """Archive file for one part of a day of affirmation results (Hive-style partition naming)"""
+    return os.path.join(ARCHIVE_DIR, "affirmation_results", f"day={day.isoformat()}", f"part-{part:05d}.json.gz")
+
+
+def _encode_part(rows: list[dict]) -> bytes:
+    """Encode rows column by column, dictionary-encoding the (highly repetitive) phrases"""
+    phrases = sorted({row["words_of_affirmation"] for row in rows})
+    phrase_index = {phrase: i for i, phrase in enumerate(phrases)}
+    columns = {
+        "affirmation_id": [row["affirmation_id"] for row in rows],
+        "words_of_affirmation": [phrase_index[row["words_of_affirmation"]] for row in rows],
+        "joy_sparked": [row["joy_sparked"] for row in rows],
+        "created_at": [row["created_at"].isoformat() for row in rows],
+        "callback_received_at": [row["callback_received_at"].isoformat() if row["callback_received_at"] else None for row in rows],
+    }
+    payload = {"row_count": len(rows), "phrases": phrases, "columns": columns}
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode())
+
+
+def _decode_part(data: bytes) -> list[dict]:
+    """Decode a part file back into rows"""
+    payload = json.loads(gzip.decompress(data))
+    phrases = payload["phrases"]
+    columns = payload["columns"]
+    return [
+        {
+            "affirmation_id": columns["affirmation_id"][i],
+            "words_of_affirmation": phrases[columns["words_of_affirmation"][i]],
+            "joy_sparked": columns["joy_sparked"][i],
+            "created_at": datetime.fromisoformat(columns["created_at"][i]),
+            "callback_received_at": datetime.fromisoformat(columns["callback_received_at"][i]) if columns["callback_received_at"][i] else None,
+        }
+        for i in range(payload["row_count"])
+    ]
+
+
+@lru_cache(maxsize=32)
+def _load_part(path: str) -> tuple[dict, ...]:
+    """Read a part file, newest rows first (parts are immutable, so they cache by path; at most 32 x ARCHIVE_BATCH_SIZE rows)"""
+    with open(path, "rb") as f:
+        rows = _decode_part(f.read())
+    return tuple(sorted(rows, key=lambda row: row["created_at"], reverse=True))
+
+
+def _write_part(path: str, rows: list[dict]) -> None:
+    """Atomically write a part file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_encode_part(rows))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _archive_batch(db: Session, cutoff: datetime) -> tuple[int, date | None]:
+    """Archive up to ARCHIVE_BATCH_SIZE eligible rows from the oldest eligible day in one transaction"""
+    eligible = db.query(AffirmationResult).filter(
+        AffirmationResult.callback_received_at.is_not(None),
+        AffirmationResult.created_at < cutoff
+    )
+    oldest = eligible.order_by(AffirmationResult.created_at).first()
+    if oldest is None:
+        return 0, None
+
+    day = oldest.created_at.date()
+    day_start = datetime.combine(day, datetime.min.time())
+    results = eligible.filter(
+        AffirmationResult.created_at >= day_start,
+        AffirmationResult.created_at < day_start + timedelta(days=1)
+    ).order_by(AffirmationResult.created_at).limit(ARCHIVE_BATCH_SIZE).all()
+    rows = [{column: getattr(result, column) for column in _COLUMNS} for result in results]
+
+    # each batch becomes a new part of its day; earlier parts are never read back or rewritten.
+    # A part written by a run that died before committing isn't in the manifest, and gets overwritten here.
+    part = (db.query(func.max(ArchivePartition.part)).filter(ArchivePartition.day == day).scalar() or 0) + 1
+    path = _part_path(day, part)
+    _write_part(path, rows)
+    db.add(ArchivePartition(
+        day=day,
+        part=part,
+        path=path,
+        row_count=len(rows),
+        min_created_at=rows[0]["created_at"],
+        max_created_at=rows[-1]["created_at"],
+        archived_at=datetime.now()
+    ))
+
+    # drop the archived rows from the hot database
+    db.query(AffirmationResult).filter(
+        AffirmationResult.affirmation_id.in_([row["affirmation_id"] for row in rows])
+    ).delete(synchronize_session=False)
+    db.commit()
+    return len(rows), day
+
+
+def _incremental_vacuum() -> None:
+    """Reclaim a bounded number of free pages so the hot file shrinks without a long full VACUUM"""
+    # (sqlite3 only frees one page per step, so the pragma's cursor has to be drained via the raw DBAPI connection)
+    raw_connection = engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+        cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_RUN})")
+        cursor.fetchall()
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
+
+def archive_completed_results(retention_days: int = RETENTION_DAYS) -> dict[str, int | str]:
+    """Move completed affirmation results older than the retention window into day partitions
+
+    Rows are archived in batches of at most ARCHIVE_BATCH_SIZE (one day per batch), each written as a
+    new part file and committed in its own transaction, so memory use and write-lock hold time stay
+    bounded. Part files are written before the hot rows are deleted and only become visible through the
+    manifest row committed with that delete, so a run interrupted at any point is simply finished by
+    the next one. Only one run executes at a time.
+    """
+    summary: dict[str, int | str] = {"status": "completed", "archived_rows": 0, "partitions": 0, "expired_keys": 0}
+    if not _archive_lock.acquire(blocking=False):
+        print("[ARCHIVE] ⏳ Archive run already in progress, skipping")
+        summary["status"] = "already_running"
+        return summary
+
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    db = SessionLocal()
+    try:
+        days: set[date] = set()
+        while True:
+            archived, day = _archive_batch(db, cutoff)
+            if not archived:
+                break
+            summary["archived_rows"] += archived
+            days.add(day)
+        summary["partitions"] = len(days)
+
+        # drop idempotency keys past their own TTL (independent of the results retention window)
+        summary["expired_keys"] = purge_expired_keys(db)
+        db.commit()
+
+        _incremental_vacuum()
+        print(f"[ARCHIVE] 📦 Archived {summary['archived_rows']} affirmation results into {summary['partitions']} day partition(s), purged {summary['expired_keys']} idempotency keys")
+    except Exception as e:
+        print(f"[ARCHIVE] ❌ Error archiving affirmation results: {e}")
+        db.rollback()
+        summary["status"] = "failed"
+    finally:
+        db.close()
+        _archive_lock.release()
+    return summary
+
+
+async def run_retention_periodically(interval_seconds: float = RETENTION_INTERVAL_SECONDS) -> None:
+    """Background loop running the retention job off the event loop thread"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(archive_completed_results)
+        except Exception as e:
+            # keep the loop alive; the next run picks up where this one stopped
+            print(f"[ARCHIVE] ❌ Retention run failed: {e}")
+
+
+def _to_local_naive(value: datetime | None) -> datetime | None:
+    """Stored timestamps are naive local time; normalise timezone-aware query bounds to match"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def query_affirmation_history(limit: int, before: datetime | None = None, since: datetime | None = None) -> list[dict]:
+    """Newest affirmation results in [since, before), reading archive partitions when the range reaches past the hot table"""
+    before = _to_local_naive(before)
+    since = _to_local_naive(since)
+
+    db = SessionLocal()
+    try:
+        query = db.query(AffirmationResult)
+        if before is not None:
+            query = query.filter(AffirmationResult.created_at < before)
+        if since is not None:
+            query = query.filter(AffirmationResult.created_at >= since)
+        hot = [
+            {column: getattr(result, column) for column in _COLUMNS}
+            for result in query.order_by(AffirmationResult.created_at.desc()).limit(limit).all()
+        ]
+
+        # find archive parts overlapping the requested range, newest day first
+        parts_query = db.query(ArchivePartition)
+        if before is not None:
+            parts_query = parts_query.filter(ArchivePartition.min_created_at < before)
+        if since is not None:
+            parts_query = parts_query.filter(ArchivePartition.max_created_at >= since)
+        parts = parts_query.order_by(ArchivePartition.day.desc(), ArchivePartition.part).all()
+    finally:
+        db.close()
+
+    # the hot page is complete unless it is short or archived rows are newer than its oldest row
+    if not parts or (len(hot) == limit and hot[-1]["created_at"] >= max(part.max_created_at for part in parts)):
+        return hot
+
+    # skip archived copies of rows still in the hot table (defensive: a committed part always deletes its hot rows)
+    hot_ids = {row["affirmation_id"] for row in hot}
+    archived: list[dict] = []
+    for day, day_parts in groupby(parts, key=lambda part: part.day):
+        # days don't overlap, but parts within a day can (late callbacks are archived in later batches),
+        # so only stop between days
+        if len(archived) >= limit:
+            break
+        for part in day_parts:
+            try:
+                rows = _load_part(part.path)
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                print(f"[ARCHIVE] ❌ Error reading archive part {part.path}: {e}")
+                continue
+            archived.extend(
+                row for row in rows
+                if row["affirmation_id"] not in hot_ids
+                and (before is None or row["created_at"] < before) and (since is None or row["created_at"] >= since)
+            )
+
+    return sorted(hot + archived, key=lambda row: row["created_at"], reverse=True)[:limit]
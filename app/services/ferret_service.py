@@ -3,13 +3,18 @@ import httpx
 import asyncio
 import random
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 
 from ..db.models import AffirmationResult, Experiment, ChampionPhrase
 from ..db.session import SessionLocal
+from .idempotency_service import find_key, record_key, remember_key
 
 
-def create_affirmation_record(affirmation_id: str, words_of_affirmation: str) -> None:
-    """Create initial database record for new affirmation"""
+def create_affirmation_record(affirmation_id: str, words_of_affirmation: str, idempotency_key: str | None = None, fingerprint: str | None = None) -> str:
+    """Create initial database record for new affirmation (and its idempotency key, in the same transaction)
+
+    Returns "created", "duplicate" (another request recorded the same idempotency key first) or "error".
+    """
     db = SessionLocal()
     try:
         # Create a temporary record with joy_sparked=False (will be updated later)
@@ -20,19 +25,39 @@ def create_affirmation_record(affirmation_id: str, words_of_affirmation: str) ->
             created_at=datetime.now()
         )
         db.add(db_affirmation)
+        claimed = record_key(db, "affirmation", idempotency_key, affirmation_id, fingerprint) if idempotency_key else None
         db.commit()
+        if claimed is not None:
+            remember_key("affirmation", idempotency_key, claimed)
         print(f"[DATABASE] 💾 Created affirmation record: {affirmation_id}")
+        return "created"
+    except IntegrityError as e:
+        db.rollback()
+        if idempotency_key and find_key(db, "affirmation", idempotency_key) is not None:
+            print(f"[DATABASE] 🔁 Idempotency key already recorded: {idempotency_key}")
+            return "duplicate"
+        print(f"[DATABASE] ❌ Error creating affirmation record: {e}")
+        return "error"
     except Exception as e:
         print(f"[DATABASE] ❌ Error creating affirmation record: {e}")
         db.rollback()
+        return "error"
     finally:
         db.close()
 
 
-def update_affirmation_result(affirmation_id: str, joy_sparked: bool) -> None:
-    """Update affirmation record with ferret reaction result"""
+def update_affirmation_result(affirmation_id: str, joy_sparked: bool) -> str:
+    """Update affirmation record with ferret reaction result
+
+    Returns "updated", "duplicate" (callback already recorded), "not_found" or "error". The dedupe key is
+    only recorded together with the row update, so a callback that failed can be redelivered.
+    """
     db = SessionLocal()
     try:
+        if find_key(db, "ferret-reaction", affirmation_id) is not None:
+            print(f"[DATABASE] 🔁 Ferret reaction already recorded: {affirmation_id}")
+            return "duplicate"
+
         db_affirmation = db.query(AffirmationResult).filter(
             AffirmationResult.affirmation_id == affirmation_id
         ).first()
@@ -40,13 +65,23 @@ def update_affirmation_result(affirmation_id: str, joy_sparked: bool) -> None:
         if db_affirmation:
             db_affirmation.joy_sparked = joy_sparked
             db_affirmation.callback_received_at = datetime.now()
+            claimed = record_key(db, "ferret-reaction", affirmation_id, str(joy_sparked))
             db.commit()
+            remember_key("ferret-reaction", affirmation_id, claimed)
             print(f"[DATABASE] 💾 Updated affirmation result: {affirmation_id} (joy={joy_sparked})")
+            return "updated"
         else:
             print(f"[DATABASE] ⚠️  Affirmation not found: {affirmation_id}")
+            return "not_found"
+    except IntegrityError:
+        # a concurrent delivery of the same callback recorded it first
+        db.rollback()
+        print(f"[DATABASE] 🔁 Ferret reaction already recorded: {affirmation_id}")
+        return "duplicate"
     except Exception as e:
         print(f"[DATABASE] ❌ Error updating affirmation result: {e}")
         db.rollback()
+        return "error"
     finally:
         db.close()
 
@@ -76,7 +111,7 @@ def create_experiment(variant_a: str, variant_b: str, target_runs: int) -> int:
 
 
 # update experiment with data
-def update_experiment(experiment_id: int, variant_a_success: bool, variant_b_success: bool, variant_tested: str | None, status: str | None = None) -> None:
+def update_experiment(experiment_id: int, variant_a_success: bool, variant_b_success: bool, variant_tested: str | None, status: str | None = None, affirmation_id: str | None = None) -> None:
     """Update experiment run in the database"""
     db = SessionLocal()
     try:
@@ -85,6 +120,15 @@ def update_experiment(experiment_id: int, variant_a_success: bool, variant_b_suc
             Experiment.id == experiment_id
         ).first()
         
+        # count each affirmation towards the experiment only once, even if its outcome is reported again
+        # (the key commits in the same transaction as the counters, so a failed update can be retried)
+        claimed = None
+        if experiment and affirmation_id is not None:
+            if find_key(db, "experiment-run", affirmation_id) is not None:
+                print(f"[INFO] 🔁 Affirmation {affirmation_id} already counted for experiment {experiment_id}")
+                return
+            claimed = record_key(db, "experiment-run", affirmation_id, str(experiment_id))
+
         # figure out which variant was tested and update accordingly
         if experiment: # check that experiment was found
             if(variant_tested == "A"): # if variant A was tested
@@ -128,7 +172,13 @@ def update_experiment(experiment_id: int, variant_a_success: bool, variant_b_suc
                             db.add(champion)
                             print(f"[DATABASE] 💾 Updated champion phrase to: '{experiment.variant_b}' based on experiment {experiment_id} results.")
             db.commit()
+            if claimed is not None:
+                remember_key("experiment-run", affirmation_id, claimed)
             print(f"[INFO] 💾 Updated experiment run {experiment_id} status to {status}")
+    except IntegrityError:
+        # a concurrent report for the same affirmation was counted first
+        print(f"[INFO] 🔁 Affirmation {affirmation_id} already counted for experiment {experiment_id}")
+        db.rollback()
     except Exception as e:
         print(f"[ERROR] ❌ Error updating experiment run: {e}")
         db.rollback()
@@ -176,7 +226,7 @@ async def process_affirmation_and_callback(affirmation_id: str, words_of_affirma
                     status = "Completed"
 
                 # update expieriment record in db
-                update_experiment(experiment_id, variant_a_success, variant_b_success,  "A" if testing_champion else "B")
+                update_experiment(experiment_id, variant_a_success, variant_b_success,  "A" if testing_champion else "B", affirmation_id=affirmation_id)
 
                 # in here we might want to do the math to figure out actual approal rates 
                 if(status == "Completed"):
@@ -184,5 +234,5 @@ async def process_affirmation_and_callback(affirmation_id: str, words_of_affirma
     except Exception as e:
         # update db with status = "Failed" for the experiment run if error occurs
         print(f"[FERRETS] ❌ Error processing affirmation {affirmation_id}: {e}")
-        update_experiment(experiment_id, False , False, None, "Failed")
+        update_experiment(experiment_id, False , False, None, "Failed", affirmation_id=affirmation_id)
 
@@ -0,0 +1,129 @@
+"""Service for idempotency keys and duplicate suppression"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy.orm import Session
+
+from ..db.models import IdempotencyKey
+from ..db.session import SessionLocal
+
+
+class ClaimedKey(NamedTuple):
+    """Result previously stored for an idempotency key"""
+    value: str
+    fingerprint: str | None
+
+
+class TTLCache:
+    """Bounded in-memory LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, ClaimedKey]] = OrderedDict()
+        # lookups and records run in asyncio.to_thread workers, so every access is serialized
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> ClaimedKey | None:
+        """Return a live entry (marking it most recently used), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, claimed = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claimed
+
+    def set(self, key: str, claimed: ClaimedKey, ttl_seconds: float | None = None) -> None:
+        """Store an entry, evicting the least recently used one when full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), claimed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# How long a processed key suppresses duplicates (in memory and in the idempotency_keys table)
+KEY_TTL = timedelta(hours=24)
+
+# Hot path for duplicates: most retries arrive within seconds, so they never touch the database
+_cache = TTLCache(max_entries=10_000, ttl_seconds=KEY_TTL.total_seconds())
+
+# Keys whose original request is still being processed by this worker
+_in_flight: set[str] = set()
+
+
+def find_key(db: Session, scope: str, key: str) -> ClaimedKey | None:
+    """Return the result stored for an unexpired key, or None if the key hasn't been processed"""
+    cache_key = f"{scope}:{key}"
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    stored = db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == cache_key,
+        IdempotencyKey.created_at >= datetime.now() - KEY_TTL
+    ).first()
+    if stored is None:
+        return None
+    claimed = ClaimedKey(stored.value, stored.fingerprint)
+    remaining = (stored.created_at + KEY_TTL - datetime.now()).total_seconds()
+    _cache.set(cache_key, claimed, ttl_seconds=remaining)
+    return claimed
+
+
+def lookup_key(scope: str, key: str) -> ClaimedKey | None:
+    """find_key() with its own session (blocking; call via asyncio.to_thread from async code)"""
+    db = SessionLocal()
+    try:
+        return find_key(db, scope, key)
+    finally:
+        db.close()
+
+
+def record_key(db: Session, scope: str, key: str, value: str, fingerprint: str | None = None) -> ClaimedKey:
+    """Add a processed key to the caller's session, so it commits (or rolls back) with the work it guards
+
+    Call remember_key() with the result once the session has committed. A concurrent duplicate
+    surfaces as an IntegrityError on commit.
+    """
+    cache_key = f"{scope}:{key}"
+    # an expired row for the same key would otherwise collide with the new one
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == cache_key,
+        IdempotencyKey.created_at < datetime.now() - KEY_TTL
+    ).delete(synchronize_session=False)
+    db.add(IdempotencyKey(key=cache_key, value=value, fingerprint=fingerprint, created_at=datetime.now()))
+    return ClaimedKey(value, fingerprint)
+
+
+def purge_expired_keys(db: Session) -> int:
+    """Delete keys past KEY_TTL (they no longer suppress anything); the caller commits"""
+    return db.query(IdempotencyKey).filter(
+        IdempotencyKey.created_at < datetime.now() - KEY_TTL
+    ).delete(synchronize_session=False)
+
+
+def remember_key(scope: str, key: str, claimed: ClaimedKey) -> None:
+    """Cache a key after the transaction that recorded it has committed"""
+    _cache.set(f"{scope}:{key}", claimed)
+
+
+def reserve_key(scope: str, key: str) -> bool:
+    """Mark a key as in flight; False if its original request is still being processed"""
+    cache_key = f"{scope}:{key}"
+    if cache_key in _in_flight:
+        return False
+    _in_flight.add(cache_key)
+    return True
+
+
+def release_key(scope: str, key: str) -> None:
+    """Clear the in-flight mark (the key only stays claimed if it was recorded and committed)"""
+    _in_flight.discard(f"{scope}:{key}")